@@ -1,7 +1,12 @@
-from typing import Any, List, Tuple, Optional, Union, Callable
+from typing import Any, Dict, List, Tuple, Optional, Union, Callable
+import math
+import operator
 import sys
 
-from boi.utils import list_to_str
+from boi.utils import list_to_str, memo_key, LRUCache
+from boi.compiler import *
+from boi.resolver import Resolver
+from boi.vm import VM
 
 class Span:
 
@@ -9,6 +14,8 @@ class Span:
     a slice of the input string
     """
 
+    __slots__ = ('start', 'end', 'slice', 'input')
+
     EMPTY = None
 
     def __init__(self, start: int, end: int, input: str):
@@ -43,109 +50,84 @@ class Context:
     # Must be initialized after the definition of the IntrinsicFunction class
     INTRINSICS = None
 
-    def __init__(self):
-        self.stack_frames = [{}]
+    def __init__(self, n_locals: int = 0, names: Optional[Dict[str, int]] = None):
+        # The values of the local variables of every active function call, laid out one frame
+        # after the other. Variables are indexed by the slot the Resolver assigned to them, and
+        # every frame is sized up front to hold all of the slots of its function. base is where
+        # the frame of the innermost call starts, and frame_bases holds those of its callers.
+        self.values = [None] * n_locals
+        self.base = 0
+        self.frame_bases = []
+
+        # Top level functions, indexed by the id of their name and then their number of
+        # arguments. The ids are handed out by the Resolver of the program (see Resolver.intern),
+        # and names it has not seen get the next free one.
+        self.names: Dict[str, int] = {} if names is None else names
+        self.functions: List[List[Optional['Function']]] = []
         for intrinsic in Context.INTRINSICS:
             self.push_function(intrinsic)
         
         self.stdout = sys.stdout
 
-    def push_stack_frame(self):
-        new_dict = dict()
-        self.stack_frames.append(new_dict)
+    def push_stack_frame(self, n_locals: int, argv: Tuple[float, ...]):
+        # The arguments of a function are always its first slots
+        self.frame_bases.append(self.base)
+        self.base = len(self.values)
+        self.values.extend(argv)
+        self.values.extend([None] * (n_locals - len(argv)))
 
     def pop_stack_frame(self):
-        return self.stack_frames.pop()
-
-    def current_stack_frame(self):
-        assert len(self.stack_frames) > 0
+        del self.values[self.base:]
+        self.base = self.frame_bases.pop()
 
-        return self.stack_frames[-1]
-
-    def push_args(self, args: List['Id'], values: List['Value']):
+    def push_args(self, args: List['Id'], values: Tuple[float, ...]):
         assert len(args) == len(values)
 
         for arg, value in zip(args, values):
             self.push_var(arg, value)
 
-    def pop_args(self, args: List['Id']):
-        return list(map(lambda arg: self.pop_var(arg), args))
-
-    def push_var(self, var: 'Id', value: 'Value'):
-        sf = self.current_stack_frame()
-
-        if var in sf:
-            raise InterpreterException("name shadowing is not supported")
-        else:
-            sf[var] = value
-    
-    def pop_var(self, var: 'Id') -> 'Value':
-        sf = self.current_stack_frame()
-
-        if var in sf:
-            return sf.pop(var)
-        else:
-            raise InterpreterException("tried to pop var which hasn't been added to the current stack frame", var.span)
+    def push_var(self, var: 'Id', value: float):
+        self.values[self.base + var.slot] = value
 
     def push_function(self, fn: 'Function'):
-        sf = self.current_stack_frame()
-
         argn = len(fn.args)
+        name_id = self.names.setdefault(fn.name.id, len(self.names))
 
-        if (fn.name, argn) in sf:
-            raise InterpreterException(f"function '{fn.name}' with {argn} arguments is already defined, and name shadowing is not supported", fn.span)
-        else:
-            sf[(fn.name, argn)] = fn
-
-    def pop_function(self, fn: 'Function'):
-        sf = self.current_stack_frame()
-        argn = len(fn.args)
-
-        if (fn.name, argn) in sf:
-            return sf.pop((fn.name, argn))
-        else:
-            raise InterpreterException(f"tried top pop function '{fn.name}' with {argn} arguments which hasn't been added to the current stack frame", fn.span)
-
-    def get_stack_frame(self, offset):
-        assert offset <= 0
-
-        if len(self.stack_frames) < abs(offset):
-            return None
+        if name_id >= len(self.functions):
+            self.functions.extend([] for _ in range(name_id + 1 - len(self.functions)))
 
-        return self.stack_frames[offset]
+        overloads = self.functions[name_id]
+        if argn >= len(overloads):
+            overloads.extend([None] * (argn + 1 - len(overloads)))
 
+        # Program.resolve has already rejected functions that are defined twice
+        overloads[argn] = fn
 
     def get_function(self, var: 'Id', argn: int):
         assert argn >= 0
 
-        sf = self.current_stack_frame()
-        offset = -1
-        
-        while sf is not None:
-            if (var, argn) in sf:
-                return sf[(var, argn)]
+        name_id = var.name_id
+        if name_id is None:
+            # Not resolved as part of the program
+            name_id = self.names.get(var.id, len(self.functions))
 
-            sf = self.get_stack_frame(offset)
-            offset -= 1
-        
-        raise InterpreterException(f"no such function '{var}' with {argn} arguments", var.span)
+        try:
+            fn = self.functions[name_id][argn]
+        except IndexError:
+            fn = None
 
-    def get_var(self, var: 'Id'):
+        if fn is None:
+            raise InterpreterException(f"no such function '{var}' with {argn} arguments", var.span)
 
-        sf = self.current_stack_frame()
-        offset = -1
-        
-        while sf is not None:
-            if var in sf:
-                return sf[var]
+        return fn
 
-            sf = self.get_stack_frame(offset)
-            offset -= 1
-        
-        raise InterpreterException(f"no variable with name '{var}'", var.span)
+    def get_var(self, var: 'Id') -> float:
+        return self.values[self.base + var.slot]
 
 class AST:
 
+    __slots__ = ('span',)
+
     @staticmethod
     def from_parse_tree(tokens: List[Any]):
         raise Exception("Unimplemented")
@@ -156,6 +138,12 @@ class AST:
     def eval(self, context: Context) -> Any:
         raise Exception("Unimplemented")
 
+    def resolve(self, resolver: Resolver):
+        raise Exception("Unimplemented")
+
+    def compile(self, compiler: Compiler):
+        raise Exception("Unimplemented")
+
     def __str__(self):
         return self.span.slice
     
@@ -164,20 +152,63 @@ class AST:
 
 class Expr(AST):
 
+    __slots__ = ()
+
     def __init__(self, span: Span):
         super().__init__(span)
 
+    def eval_num(self, context: Context) -> float:
+        """
+        evaluates the expression without wrapping the result in a Value
+        """
+
+        return self.eval(context).value
+
+    def fold(self) -> 'Expr':
+        """
+        returns the Value this expression always evaluates to if it is constant, or an
+        equivalent expression otherwise. Parents fold their children when they are built,
+        so constant subtrees collapse from the bottom up.
+        """
+
+        return self
+
+    def mark_tail_calls(self, fn: 'Function'):
+        """
+        called on the body of every top level function fn once it is resolved, and passed on to
+        whatever is evaluated last. Calls from there back to fn can reuse the frame they are in.
+        """
+
+        pass
+
 class Id(Expr):
 
+    __slots__ = ('id', 'name_id', 'slot')
+
     def __init__(self, id: str, span: Span):
         super().__init__(span)
 
         self.id = id
 
+        # Assigned by the Resolver, name_id only to the names of called functions
+        self.name_id = None
+        self.slot = None
 
     def eval(self, context: Context) -> 'Value':
+        return Value.of(context.get_var(self), Span.EMPTY)
+
+    def eval_num(self, context: Context) -> float:
         return context.get_var(self)
 
+    def resolve(self, resolver: Resolver):
+        self.slot = resolver.get_var(self)
+
+        if self.slot is None:
+            raise InterpreterException(f"no variable with name '{self}'", self.span)
+
+    def compile(self, compiler: Compiler):
+        compiler.emit(OP_LOAD_VAR, self.slot)
+
     def __repr__(self):
         return f"Id('{self.id}', {repr(self.span)})"
 
@@ -195,11 +226,34 @@ class Id(Expr):
 
 
 class Value(Expr):
+
+    # _hash is only set once the value is hashed
+    __slots__ = ('value', '_hash')
+
+    # Must be initialized after the definition of the Value class
+    INTERNED = None
     
     def __init__(self, value: float, span: Span):
         super().__init__(span)
         self.value = value
 
+    @staticmethod
+    def of(value: float, span: Span) -> 'Value':
+        """
+        like the constructor, but small integral values without a span share a single instance.
+        Values computed while the program runs are built without a span, since spans only point
+        errors at the source.
+        """
+
+        if span is Span.EMPTY:
+            interned = Value.INTERNED.get(value)
+
+            # -0.0 == 0.0, but only 0.0 is interned
+            if interned is not None and (value or math.copysign(1.0, value) > 0.0):
+                return interned
+
+        return Value(value, span)
+
     def __repr__(self):
         return f"Value({self.value}, {repr(self.span)})"
 
@@ -209,6 +263,15 @@ class Value(Expr):
     def eval(self, _context: Context) -> 'Value':
         return self
 
+    def eval_num(self, _context: Context) -> float:
+        return self.value
+
+    def resolve(self, resolver: Resolver):
+        pass
+
+    def compile(self, compiler: Compiler):
+        compiler.emit(OP_CONST, compiler.add_const(self.value))
+
     def __add__(self, other):
         return self.value + other.value
 
@@ -225,7 +288,7 @@ class Value(Expr):
         return self.value % other.value
 
     def __pow__(self, other):
-        return self.value % other.value
+        return self.value ** other.value
 
     def __lt__(self, other):
         return self.value < other.value
@@ -245,20 +308,47 @@ class Value(Expr):
     def __ne__(self, other):
         return self.value != other.value
 
+    def __hash__(self):
+        # Equal values have to hash the same, so this is the hash of the float
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(self.value)
+            return self._hash
+
+
+Value.INTERNED = {float(i): Value(float(i), Span.EMPTY) for i in range(-128, 129)}
+for interned in Value.INTERNED.values():
+    hash(interned)
+
 
 class MultiplicativeExpr(Expr):
 
+    __slots__ = ('lhs', 'operator', 'rhs', '_apply', '_const')
+
     MULTIPLICATION  = 0
     DIVISION        = 1
 
+    OPERATOR_FNS = [operator.mul, operator.truediv]
+
     def __init__(self, lhs: Expr, operator: int, rhs: Expr, span: Span):
         super().__init__(span)
 
         assert 0 <= operator <= 1 
 
-        self.lhs = lhs
+        self.lhs = lhs.fold()
         self.operator = operator
-        self.rhs = rhs
+        self.rhs = rhs.fold()
+
+        self._apply = MultiplicativeExpr.OPERATOR_FNS[operator]
+
+        self._const = None
+        if type(self.lhs) == Value and type(self.rhs) == Value:
+            try:
+                self._const = Value.of(self._apply(self.lhs.value, self.rhs.value), span)
+            except ZeroDivisionError:
+                # Left for the program to run into
+                pass
 
     def __str__(self):
         if self.operator == 0:
@@ -270,26 +360,58 @@ class MultiplicativeExpr(Expr):
         return f"MultiplicativeExpr({repr(self.lhs)}, {self.operator}, {repr(self.rhs)}, {repr(self.span)})"
 
     def eval(self, context: Context) -> Value:
-        lhs_value = self.lhs.eval(context)
-        rhs_value = self.rhs.eval(context)
+        if self._const is not None:
+            return self._const
+
+        return Value.of(self.eval_num(context), Span.EMPTY)
+
+    def eval_num(self, context: Context) -> float:
+        return self._apply(self.lhs.eval_num(context), self.rhs.eval_num(context))
+
+    def fold(self) -> Expr:
+        return self if self._const is None else self._const
+
+    def resolve(self, resolver: Resolver):
+        self.lhs.resolve(resolver)
+        self.rhs.resolve(resolver)
+
+    def compile(self, compiler: Compiler):
+        if self._const is not None:
+            self._const.compile(compiler)
+            return
+
+        self.lhs.compile(compiler)
+        self.rhs.compile(compiler)
 
         if self.operator == MultiplicativeExpr.MULTIPLICATION:
-            new_value = lhs_value.value * rhs_value.value
+            compiler.emit(OP_MUL)
         else:
-            new_value = lhs_value.value / rhs_value.value
+            compiler.emit(OP_DIV)
 
-        assert type(new_value) == float
 
-        return Value(new_value, self.span)
+class PowExpr(Expr):
 
+    __slots__ = ('lhs', 'rhs', '_const')
 
-class PowExpr(Expr):
+    # Every value is a real number, so a negative base to a fractional power is an error
+    COMPLEX_RESULT = "a negative number to a fractional power is not a real number"
 
     def __init__(self, lhs: MultiplicativeExpr, rhs: MultiplicativeExpr, span: Span):
         super().__init__(span)
 
-        self.lhs = lhs
-        self.rhs = rhs
+        self.lhs = lhs.fold()
+        self.rhs = rhs.fold()
+
+        self._const = None
+        if type(self.lhs) == Value and type(self.rhs) == Value:
+            try:
+                value = self.lhs.value ** self.rhs.value
+            except (OverflowError, ZeroDivisionError):
+                # Left for the program to run into
+                value = None
+
+            if type(value) == float:
+                self._const = Value.of(value, span)
 
     def __str__(self):
         return f"({self.lhs} ^ {self.rhs}) "
@@ -298,29 +420,60 @@ class PowExpr(Expr):
         return f"PowExpr({repr(self.lhs)}, {repr(self.rhs)}, {repr(self.span)})"
 
     def eval(self, context: Context) -> Value:
-        lhs_value = self.lhs.eval(context)
-        rhs_value = self.rhs.eval(context)
+        if self._const is not None:
+            return self._const
 
-        new_value = lhs_value ** rhs_value
-    
-        assert type(new_value) == float
+        return Value.of(self.eval_num(context), Span.EMPTY)
+
+    def eval_num(self, context: Context) -> float:
+        new_value = self.lhs.eval_num(context) ** self.rhs.eval_num(context)
+
+        if type(new_value) == complex:
+            raise InterpreterException(PowExpr.COMPLEX_RESULT, self.span)
+
+        return new_value
+
+    def fold(self) -> Expr:
+        return self if self._const is None else self._const
+
+    def resolve(self, resolver: Resolver):
+        self.lhs.resolve(resolver)
+        self.rhs.resolve(resolver)
+
+    def compile(self, compiler: Compiler):
+        if self._const is not None:
+            self._const.compile(compiler)
+            return
 
-        return Value(new_value, self.span)
+        self.lhs.compile(compiler)
+        self.rhs.compile(compiler)
+
+        compiler.emit(OP_POW)
 
 
 class AdditiveExpr(Expr):
 
+    __slots__ = ('lhs', 'operator', 'rhs', '_apply', '_const')
+
     ADDITION    = 0
     SUBTRACTION = 1
 
+    OPERATOR_FNS = [operator.add, operator.sub]
+
     def __init__(self, lhs: PowExpr, operator: int, rhs: PowExpr, span: Span):
         super().__init__(span)
 
         assert 0 <= operator <= 1 
 
-        self.lhs = lhs
+        self.lhs = lhs.fold()
         self.operator = operator
-        self.rhs = rhs
+        self.rhs = rhs.fold()
+
+        self._apply = AdditiveExpr.OPERATOR_FNS[operator]
+
+        self._const = None
+        if type(self.lhs) == Value and type(self.rhs) == Value:
+            self._const = Value.of(self._apply(self.lhs.value, self.rhs.value), span)
 
     def __str__(self):
         if self.operator == 0:
@@ -331,27 +484,48 @@ class AdditiveExpr(Expr):
         return f"AdditiveExpr({repr(self.lhs)}, {self.operator}, {repr(self.rhs)}, {repr(self.span)})"
 
     def eval(self, context: Context) -> Value:
-        lhs_value = self.lhs.eval(context)
-        rhs_value = self.rhs.eval(context)
+        if self._const is not None:
+            return self._const
 
-        if self.operator == AdditiveExpr.ADDITION:
-            new_value = lhs_value + rhs_value
-        else:
-            new_value = lhs_value - rhs_value
+        return Value.of(self.eval_num(context), Span.EMPTY)
 
-        assert type(new_value) == float
+    def eval_num(self, context: Context) -> float:
+        return self._apply(self.lhs.eval_num(context), self.rhs.eval_num(context))
 
-        return Value(new_value, self.span)
+    def fold(self) -> Expr:
+        return self if self._const is None else self._const
+
+    def resolve(self, resolver: Resolver):
+        self.lhs.resolve(resolver)
+        self.rhs.resolve(resolver)
+
+    def compile(self, compiler: Compiler):
+        if self._const is not None:
+            self._const.compile(compiler)
+            return
+
+        self.lhs.compile(compiler)
+        self.rhs.compile(compiler)
+
+        if self.operator == AdditiveExpr.ADDITION:
+            compiler.emit(OP_ADD)
+        else:
+            compiler.emit(OP_SUB)
 
 
 class ConditionExpr(Expr):
 
-    FALSE_VALUES = [0.0, "", []]
+    __slots__ = ('expr', '_const')
 
     def __init__(self, expr: Expr, span: Span):
         super().__init__(span)
 
-        self.expr = expr
+        self.expr = expr.fold()
+
+        # Whether the condition always holds, if it is constant
+        self._const = None
+        if type(self.expr) == Value:
+            self._const = self.expr.value != 0.0
 
     def __str__(self):
         return str(self.expr)
@@ -360,11 +534,20 @@ class ConditionExpr(Expr):
         return f"ConditionExpr({repr(self.expr)}, {repr(self.span)})"
 
     def eval(self, context: Context) -> bool:
-        return self.expr.eval(context).value not in ConditionExpr.FALSE_VALUES
+        # Every value is a float, and only 0.0 is false
+        return self.expr.eval_num(context) != 0.0
+
+    def resolve(self, resolver: Resolver):
+        self.expr.resolve(resolver)
+
+    def compile(self, compiler: Compiler):
+        self.expr.compile(compiler)
 
 
 class ComparisonExpr(Expr):
 
+    __slots__ = ('lhs', 'rhs', 'operator', '_apply', '_const')
+
     GT = 0
     GTE = 1
     LT = 2
@@ -372,15 +555,6 @@ class ComparisonExpr(Expr):
     EQ = 4
     NEQ = 5
 
-    COMPARISON_FNS = {
-        GT:     lambda l, r: l > r,
-        GTE:    lambda l, r: l >= r,
-        LT:     lambda l, r: l < r,
-        LTE:    lambda l, r: l <= r,
-        EQ:     lambda l, r: l == r,
-        NEQ:    lambda l, r: l != r
-    }
-
     COMPARISON_OP_TO_STR = {
         GT:     ">",
         GTE:    ">=",
@@ -395,10 +569,17 @@ class ComparisonExpr(Expr):
 
         assert 0 <= operator <= 5
 
-        self.lhs = lhs
-        self.rhs = rhs
+        self.lhs = lhs.fold()
+        self.rhs = rhs.fold()
         self.operator = operator
 
+        self._apply = CMP_FNS[operator]
+
+        # Whether the comparison always holds, if it is constant
+        self._const = None
+        if type(self.lhs) == Value and type(self.rhs) == Value:
+            self._const = self._apply(self.lhs.value, self.rhs.value)
+
     def __str__(self):
         return f"{self.lhs} + {ComparisonExpr.COMPARISON_OP_TO_STR[self.operator]} + {self.rhs}"
 
@@ -406,20 +587,32 @@ class ComparisonExpr(Expr):
         return f"ComparisonExpr({repr(self.lhs)}, {self.operator}, {repr(self.rhs)}, {repr(self.span)})"
 
     def eval(self, context: Context):
-        return ComparisonExpr.COMPARISON_FNS[self.operator](self.lhs.eval(context), self.rhs.eval(context))
+        return self._apply(self.lhs.eval_num(context), self.rhs.eval_num(context))
+
+    def resolve(self, resolver: Resolver):
+        self.lhs.resolve(resolver)
+        self.rhs.resolve(resolver)
+
+    def compile(self, compiler: Compiler):
+        self.lhs.compile(compiler)
+        self.rhs.compile(compiler)
+
+        compiler.emit(OP_CMP, self.operator)
 
 
 class LambdaExpr(Expr):
 
+    __slots__ = ('name', 'args', 'value', 'body', 'as_fn')
+
     def __init__(self, name: Id, args: List[Id], value: Expr, body: Expr, span: Span):
         super().__init__(span)
 
         self.name = name
         self.args = args
-        self.value = value
-        self.body = body
+        self.value = value.fold()
+        self.body = body.fold()
 
-        self.as_fn = Function(name, args, value, span, is_lambda=True)
+        self.as_fn = Function(name, args, self.value, span, is_lambda=True)
     
     def __str__(self):
         return f"let {self.name} {list_to_str(self.args)} = {self.value} in \n    {self.body}"
@@ -428,23 +621,49 @@ class LambdaExpr(Expr):
         return f"LambdaExpr({repr(self.name)}, {repr(self.args)}, {repr(self.value)}, {repr(self.body)}, {repr(self.span)})"
 
     def eval(self, context: Context) -> Value:
-        context.push_function(self.as_fn)
+        # Calls to the lambda are bound to it by the Resolver
+        return self.body.eval(context)
+
+    def eval_num(self, context: Context) -> float:
+        return self.body.eval_num(context)
+
+    def resolve(self, resolver: Resolver):
+        argn = len(self.args)
+
+        if resolver.get_lambda(self.name, argn) is not None:
+            raise InterpreterException(f"function '{self.name}' with {argn} arguments is already defined, and name shadowing is not supported", self.span)
 
-        result = self.body.eval(context)
+        resolver.push_lambda(self.as_fn)
 
-        _fn = context.pop_function(self.as_fn)
+        self.as_fn.resolve_lambda(resolver)
+        self.body.resolve(resolver)
 
-        return result
+        resolver.pop_lambda(self.as_fn)
+
+    def mark_tail_calls(self, fn: 'Function'):
+        # Calls in the value of the lambda run inside a call to the lambda (under a CALL_LOCAL
+        # frame in compiled code), so they can't reuse the frame of the function; only the body
+        # is in tail position
+        self.body.mark_tail_calls(fn)
+
+    def compile(self, compiler: Compiler):
+        # The lambda is compiled once, out of the way of the code around it
+        jmp_over = compiler.emit(OP_JMP)
+        self.as_fn.compile_lambda(compiler)
+        compiler.patch(jmp_over, compiler.here())
+
+        self.body.compile(compiler)
 
 class LetExpr(Expr):
 
+    __slots__ = ('name', 'value', 'body')
+
     def __init__(self, name: Id, value: Expr, body: Expr, span: Span):
         super().__init__(span)
 
         self.name = name
-        self.value = value
-        self.body = body
-        self.value = value
+        self.value = value.fold()
+        self.body = body.fold()
 
     def __str__(self):
         return f"let {self.name} = {self.value} in {self.body}"
@@ -453,24 +672,56 @@ class LetExpr(Expr):
         return f"LetExpr({repr(self.name)}, {repr(self.value)}, {repr(self.body)}, {repr(self.span)})"
     
     def eval(self, context: Context) -> Value:
-        val = self.value.eval(context) 
-        
-        context.push_var(self.name, val)
+        context.push_var(self.name, self.value.eval_num(context))
 
-        body_value = self.body.eval(context)
+        return self.body.eval(context)
 
-        context.pop_var(self.name)
+    def eval_num(self, context: Context) -> float:
+        context.push_var(self.name, self.value.eval_num(context))
 
-        return body_value
+        return self.body.eval_num(context)
+
+    def resolve(self, resolver: Resolver):
+        self.value.resolve(resolver)
+
+        if resolver.get_var(self.name) is not None:
+            raise InterpreterException("name shadowing is not supported", self.name.span)
+
+        resolver.push_var(self.name)
+        self.body.resolve(resolver)
+        resolver.pop_var(self.name)
+
+    def mark_tail_calls(self, fn: 'Function'):
+        self.body.mark_tail_calls(fn)
+
+    def compile(self, compiler: Compiler):
+        self.value.compile(compiler)
+
+        compiler.emit(OP_STORE_VAR, self.name.slot)
+
+        self.body.compile(compiler)
 
 
 class FunctionCall(Expr):
 
+    __slots__ = ('name', 'argv', '_argn', 'target', 'tail')
+
+    # Returned by a tail call in place of its result, see Function.eval
+    TAIL_CALL = object()
+
     def __init__(self, name: Id, argv: List[Expr], span: Span):
         super().__init__(span)
 
         self.name = name
-        self.argv = argv
+        self.argv = [exp.fold() for exp in argv]
+        self._argn = len(self.argv)
+
+        # The lambda this calls, if any, assigned by the Resolver
+        self.target = None
+
+        # The function this is a tail call of, if it calls the function it is in from a tail
+        # position (see Expr.mark_tail_calls)
+        self.tail = None
 
     def __str__(self):
         return f"({self.name} {list_to_str(self.argv)})"
@@ -478,22 +729,100 @@ class FunctionCall(Expr):
     def __repr__(self):
         return f"FunctionCall({repr(self.name)}, {repr(self.argv)}, {repr(self.span)})"
 
-    def eval(self, context: Context):
-        fn = context.get_function(self.name, len(self.argv))
-        argv = list(map(lambda exp: exp.eval(context), self.argv))
-        fn.set_args(argv)
+    def eval(self, context: Context) -> Value:
+        return Value.of(self.eval_num(context), Span.EMPTY)
+
+    def eval_num(self, context: Context) -> float:
+        fn = self.target
+        if fn is None:
+            fn = self.tail or context.get_function(self.name, self._argn)
+
+        # Most calls have one or two arguments
+        if self._argn == 1:
+            argv = (self.argv[0].eval_num(context),)
+        elif self._argn == 2:
+            a, b = self.argv
+            argv = (a.eval_num(context), b.eval_num(context))
+        else:
+            argv = tuple([exp.eval_num(context) for exp in self.argv])
+
+        if self.tail is not None:
+            # Rebind the arguments of the current call, Function.eval then runs the body again
+            context.push_args(fn.args, argv)
+            return FunctionCall.TAIL_CALL
 
-        return fn.eval(context)
+        if fn.pure:
+            key = memo_key(argv)
+            r = fn.memo.lookup(key)
+
+            if r is None:
+                r = fn.eval(context, argv)
+                fn.memo.store(key, r)
+
+            return r
+
+        return fn.eval(context, argv)
+
+    def resolve(self, resolver: Resolver):
+        for exp in self.argv:
+            exp.resolve(resolver)
+
+        self.target = resolver.get_lambda(self.name, len(self.argv))
+
+        if self.target is None:
+            self.name.name_id = resolver.intern(self.name)
+            resolver.calls.add((self.name.id, len(self.argv)))
+
+        if self.target in resolver.resolving:
+            raise InterpreterException(f"lambda '{self.name}' can not call itself", self.span)
+
+    def mark_tail_calls(self, fn: 'Function'):
+        if self.target is None and self.name.id == fn.name.id and self._argn == len(fn.args):
+            self.tail = fn
+
+    def compile(self, compiler: Compiler):
+        argn = len(self.argv)
+
+        for exp in self.argv:
+            exp.compile(compiler)
+
+        if self.target is not None:
+            assert self.target.start is not None
+            compiler.emit(OP_CALL_LOCAL, self.target.start)
+            return
+
+        index = compiler.get_function(self.name, argn)
+
+        if index is None:
+            raise InterpreterException(f"no such function '{self.name}' with {argn} arguments", self.name.span)
+
+        if type(compiler.functions[index]) == IntrinsicFunction:
+            compiler.emit(OP_CALL_INTRINSIC, index)
+        elif self.tail is not None:
+            compiler.emit(OP_TAILCALL, index)
+        else:
+            compiler.emit(OP_CALL, index)
 
 
 class IfExpr(Expr):
 
+    __slots__ = ('condition', 'true_expr', 'false_expr', '_predicate')
+
     def __init__(self, condition: ConditionExpr, true_expr: Expr, false_expr: Expr, span: Span):
         super().__init__(span)
 
         self.condition = condition
-        self.true_expr = true_expr
-        self.false_expr = false_expr
+        self.true_expr = true_expr.fold()
+        self.false_expr = false_expr.fold()
+
+        # Tests the condition without going through the ConditionExpr around it
+        inner = condition.expr if type(condition) == ConditionExpr else condition
+        if type(inner) == ComparisonExpr:
+            self._predicate = inner.eval
+        elif type(condition) == ConditionExpr:
+            self._predicate = lambda context: inner.eval_num(context) != 0.0
+        else:
+            self._predicate = condition.eval
 
     def __repr__(self):
         return f"IfExpr({repr(self.condition)}, {repr(self.true_expr)}, {repr(self.false_expr)}, {repr(self.span)})"
@@ -502,29 +831,71 @@ class IfExpr(Expr):
         return f"if {self.condition} then {self.true_expr} else {self.false_expr}"
 
     def eval(self, context: Context) -> Value:
-        if self.condition.eval(context):
-            return self.true_expr.eval(context)
-        else:
-            return self.false_expr.eval(context)
+        return (self.true_expr if self._predicate(context) else self.false_expr).eval(context)
+
+    def eval_num(self, context: Context) -> float:
+        return (self.true_expr if self._predicate(context) else self.false_expr).eval_num(context)
+
+    def fold(self) -> Expr:
+        if self.condition._const is None:
+            return self
+
+        return self.true_expr if self.condition._const else self.false_expr
+
+    def resolve(self, resolver: Resolver):
+        self.condition.resolve(resolver)
+        self.true_expr.resolve(resolver)
+        self.false_expr.resolve(resolver)
+
+    def mark_tail_calls(self, fn: 'Function'):
+        self.true_expr.mark_tail_calls(fn)
+        self.false_expr.mark_tail_calls(fn)
+
+    def compile(self, compiler: Compiler):
+        if self.condition._const is not None:
+            self.fold().compile(compiler)
+            return
+
+        self.condition.compile(compiler)
+        jmp_to_false = compiler.emit(OP_JMP_IF_FALSE)
+
+        self.true_expr.compile(compiler)
+        jmp_to_end = compiler.emit(OP_JMP)
+
+        compiler.patch(jmp_to_false, compiler.here())
+        self.false_expr.compile(compiler)
+
+        compiler.patch(jmp_to_end, compiler.here())
 
 
 class Function(AST):
 
+    __slots__ = ('name', 'args', 'value', 'is_lambda', 'n_locals', 'calls', 'pure', 'memo', 'start')
+
+    # The number of results remembered for every pure function
+    MEMO_SIZE = 1024
+
     def __init__(self, name: Id, args: List[Id], value: Expr, span: Span, is_lambda: bool = False):
         super().__init__(span)
 
         self.name = name
         self.args = args
-        self.value = value
+        self.value = value.fold()
         self.is_lambda = is_lambda
 
-        self.argv = None
-    
-    def set_args(self, argv: List[Value]):
-        if len(argv) != len(self.args):
-            raise Exception("Interpreter Error: Calling function with wrong number of arguments.")
-        
-        self.argv = argv
+        # The number of slots this function needs in its frame and the top level functions it
+        # calls, assigned by the Resolver
+        self.n_locals = 0
+        self.calls = set()
+
+        # Whether the result only depends on the arguments (see Program.infer_purity), in
+        # which case results are remembered
+        self.pure = False
+        self.memo = LRUCache(Function.MEMO_SIZE)
+
+        # Where the compiled code of a lambda starts, top level functions keep theirs in
+        # their CodeObject
+        self.start = None
 
     def __str__(self):
         return f"let {self.name} {list_to_str(self.args)} = {self.value}"
@@ -532,31 +903,100 @@ class Function(AST):
     def __repr__(self):
         return f"Function({repr(self.name)}, {repr(self.args)}, {repr(self.value)}, {repr(self.span)}, is_lambda = {self.is_lambda})"
 
-    def eval(self, context: Context) -> Value:
+    def eval(self, context: Context, argv: Tuple[float, ...]) -> float:
         """
-        set_args must be called before this function is called
+        argv must have one value for every argument; FunctionCall looks functions up by name
+        and number of arguments, so this always holds
         """
 
-        assert self.argv != None 
+        if self.is_lambda:
+            context.push_args(self.args, argv)
+            return self.value.eval_num(context)
 
-        if not self.is_lambda:
-            context.push_stack_frame()
+        context.push_stack_frame(self.n_locals, argv)
 
-        context.push_args(self.args, self.argv)
-        
-        r = self.value.eval(context)
-        
-        self.argv = None
+        # Tail calls to this function have already rebound the arguments
+        r = self.value.eval_num(context)
+        while r is FunctionCall.TAIL_CALL:
+            r = self.value.eval_num(context)
 
-        _argv = context.pop_args(self.args)
-
-        if not self.is_lambda:
-            context.pop_stack_frame()
+        context.pop_stack_frame()
 
         return r
 
+    def push_args(self, resolver: Resolver):
+        for arg in self.args:
+            if resolver.get_var(arg) is not None:
+                raise InterpreterException("name shadowing is not supported", arg.span)
+
+            resolver.push_var(arg)
+
+    def resolve(self, resolver: Resolver):
+        resolver.enter_function()
+
+        self.push_args(resolver)
+        self.value.resolve(resolver)
+        self.value.mark_tail_calls(self)
+
+        self.n_locals = resolver.n_locals
+        self.calls = resolver.calls
+
+    def resolve_lambda(self, resolver: Resolver):
+        """
+        lambdas are resolved where they are defined, and their arguments and locals are
+        given slots in the frame of the enclosing function
+        """
+
+        resolver.resolving.add(self)
+
+        self.push_args(resolver)
+        self.value.resolve(resolver)
+
+        for arg in self.args:
+            resolver.pop_var(arg)
+
+        resolver.resolving.remove(self)
+
+    def compile(self, compiler: Compiler):
+        """
+        compiles the body of a top level function. The CodeObject must already be
+        in the function table of the compiler (see Program.compile)
+        """
+
+        code = compiler.functions[compiler.get_function(self.name, len(self.args))]
+
+        code.start = compiler.here()
+        code.n_locals = self.n_locals
+
+        if self.pure:
+            code.memo = self.memo
+
+        self.value.compile(compiler)
+
+        compiler.emit(OP_RET)
+
+        code.max_stack = compiler.max_stack(code.start, compiler.here())
+
+    def compile_lambda(self, compiler: Compiler):
+        """
+        lambdas are compiled as subroutines that run in the frame of the enclosing function.
+        They are called with OP_CALL_LOCAL, with the arguments on top of the stack, and store
+        them in their slots of that frame before running the body.
+        """
+
+        self.start = compiler.here()
+
+        for arg in reversed(self.args):
+            compiler.emit(OP_STORE_VAR, arg.slot)
+
+        self.value.compile(compiler)
+
+        compiler.emit(OP_RET_LOCAL)
+
 class IntrinsicFunction(AST):
 
+    __slots__ = ('name', 'args', 'fn', 'pure')
+
     INTRINSIC_FUNCTIONS = [
         (Id("print", Span.EMPTY), [Id("x", Span.EMPTY)], lambda context, x: print(x.value, file=context.stdout))
     ]
@@ -568,7 +1008,8 @@ class IntrinsicFunction(AST):
         self.args = args
         self.fn = fn
 
-        self.argv = None
+        # Intrinsics have side effects
+        self.pure = False
 
     def __str__(self):
         return f"<intrinsic> {self.name} {list_to_str(self.args)} = ..."
@@ -576,16 +1017,11 @@ class IntrinsicFunction(AST):
     def __repr__(self):
         return object.__repr__(self)
 
-    def set_args(self, argv: List[Value]):
-        if len(argv) != len(self.args):
-            raise InterpreterException("attempted to call a function with wrong number of arguments")
-        
-        self.argv = argv
+    def eval(self, context: Context, argv: Tuple[float, ...]) -> float:
+        return self.call(context, argv)
 
-    def eval(self, context: Context):
-        assert self.argv != None
-        
-        r = self.fn(context, *self.argv)
+    def call(self, context: Context, argv: Tuple[float, ...]) -> float:
+        r = self.fn(context, *[Value.of(v, Span.EMPTY) for v in argv])
 
         if r is None:
             r = 0.0
@@ -602,17 +1038,99 @@ class Program:
 
     def __init__(self, statements: List[Union[Function, Expr]]):
         self.statements = statements
-        self.context = Context()
 
-    def run(self, stdout=sys.stdout):
+        self.n_locals = 0
+        self.names = {}
+        self.resolve()
+
+        self.context = Context(self.n_locals, self.names)
+
+        # The VM of the last run
+        self.vm = None
+
+    def run(self, stdout=sys.stdout, jit: bool = False):
         self.context.stdout = stdout
         for statement in self.statements:
-            ty = type(statement)
-
-            if ty == Function:
+            if type(statement) == Function:
                 self.context.push_function(statement)
+
+        compiler = Compiler()
+        main = self.compile(compiler)
+
+        self.vm = VM(self.context, compiler.code, compiler.consts, compiler.functions, jit=jit)
+        self.vm.run(main)
+
+    def resolve(self):
+        resolver = Resolver()
+        defined = {(intrinsic.name.id, len(intrinsic.args)) for intrinsic in Context.INTRINSICS}
+
+        for statement in self.statements:
+            if type(statement) == Function:
+                argn = len(statement.args)
+
+                if (statement.name.id, argn) in defined:
+                    raise InterpreterException(f"function '{statement.name}' with {argn} arguments is already defined, and name shadowing is not supported", statement.span)
+
+                defined.add((statement.name.id, argn))
+                statement.resolve(resolver)
             else:
-                statement.eval(self.context)
+                resolver.enter_function()
+                statement.resolve(resolver)
+
+                self.n_locals = max(self.n_locals, resolver.n_locals)
+
+        self.names = resolver.names
+        self.infer_purity()
+
+    def infer_purity(self):
+        """
+        a function is pure if every function it calls is pure. Lambdas are never pure,
+        since they can read the variables of the function they are defined in.
+        """
+
+        functions = {(statement.name.id, len(statement.args)): statement for statement in self.statements if type(statement) == Function}
+
+        for fn in functions.values():
+            fn.pure = True
+
+        changed = True
+        while changed:
+            changed = False
+
+            for fn in functions.values():
+                if fn.pure and not all(call in functions and functions[call].pure for call in fn.calls):
+                    fn.pure = False
+                    changed = True
+
+    def compile(self, compiler: Compiler) -> CodeObject:
+        """
+        compiles every function and then the top level expressions, returning the
+        CodeObject of the latter. Functions are visible to the whole program.
+        """
+
+        for intrinsic in Context.INTRINSICS:
+            compiler.define_function(intrinsic.name.id, len(intrinsic.args), intrinsic)
+
+        functions = [statement for statement in self.statements if type(statement) == Function]
+
+        for fn in functions:
+            argn = len(fn.args)
+            compiler.define_function(fn.name.id, argn, CodeObject(fn.name.id, 0, argn, 0))
+
+        for fn in functions:
+            fn.compile(compiler)
+
+        start = compiler.here()
+
+        for statement in self.statements:
+            if type(statement) != Function:
+                statement.compile(compiler)
+                compiler.emit(OP_POP)
+
+        compiler.emit(OP_CONST, compiler.add_const(0.0))
+        compiler.emit(OP_RET)
+
+        return CodeObject("<main>", start, 0, self.n_locals)
     
     def __repr__(self):
         return f"Program({repr(self.statements)})"
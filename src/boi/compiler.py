@@ -0,0 +1,118 @@
+import math
+import operator
+from typing import Any, Dict, List, Optional, Tuple
+
+# Every instruction is two words wide: an opcode followed by its argument (0 if unused)
+OP_CONST            = 0
+OP_LOAD_VAR         = 1
+OP_STORE_VAR        = 2
+OP_ADD              = 3
+OP_SUB              = 4
+OP_MUL              = 5
+OP_DIV              = 6
+OP_POW              = 7
+OP_CMP              = 8
+OP_JMP              = 9
+OP_JMP_IF_FALSE     = 10
+OP_CALL             = 11
+OP_CALL_INTRINSIC   = 12
+OP_RET              = 13
+OP_POP              = 14
+OP_TAILCALL         = 15
+OP_CALL_LOCAL       = 16
+OP_RET_LOCAL        = 17
+
+# Instructions that leave at most one more value on the stack than they take off it; all
+# others leave fewer
+PUSH_OPS = {OP_CONST, OP_LOAD_VAR, OP_CALL, OP_CALL_INTRINSIC, OP_CALL_LOCAL}
+
+# Indexed by the ComparisonExpr operator constants (GT, GTE, LT, LTE, EQ, NEQ)
+CMP_FNS = [operator.gt, operator.ge, operator.lt, operator.le, operator.eq, operator.ne]
+
+
+class CodeObject:
+
+    """
+    the entry point and frame layout of a compiled function
+    """
+
+    def __init__(self, name: str, start: int, n_args: int, n_locals: int):
+        self.name = name
+        self.start = start
+        self.n_args = n_args
+        self.n_locals = n_locals
+
+        # The results of previous calls, only set for pure functions
+        self.memo = None
+
+        # An upper bound on the number of values the code of the function keeps on the stack
+        # above its locals, see Compiler.max_stack
+        self.max_stack = 0
+
+    def __repr__(self):
+        return f"CodeObject('{self.name}', {self.start}, {self.n_args}, {self.n_locals})"
+
+
+class Compiler:
+
+    """
+    flattens a resolved AST into a single list of instructions that can be run by the VM.
+    Every AST node knows how to compile itself; the compiler only keeps track of the
+    emitted code, the constant pool and the function table.
+    """
+
+    def __init__(self):
+        self.code: List[int] = []
+        self.consts: List[float] = []
+        self.const_ids: Dict[Tuple[type, float, float], int] = {}
+
+        # Either CodeObjects or IntrinsicFunctions, indexed by the argument of OP_CALL
+        self.functions: List[Any] = []
+        self.function_ids: Dict[Tuple[str, int], int] = {}
+
+    def here(self) -> int:
+        return len(self.code)
+
+    def emit(self, op: int, arg: int = 0) -> int:
+        at = len(self.code)
+
+        self.code.append(op)
+        self.code.append(arg)
+
+        return at
+
+    def patch(self, at: int, arg: int):
+        self.code[at + 1] = arg
+
+    def add_const(self, value: float) -> int:
+        # -0.0 == 0.0, so the sign is part of the key
+        key = (type(value), value, math.copysign(1.0, value))
+
+        if key not in self.const_ids:
+            self.const_ids[key] = len(self.consts)
+            self.consts.append(value)
+
+        return self.const_ids[key]
+
+    def define_function(self, name: str, argn: int, fn: Any) -> int:
+        assert (name, argn) not in self.function_ids
+
+        self.function_ids[(name, argn)] = len(self.functions)
+        self.functions.append(fn)
+
+        return self.function_ids[(name, argn)]
+
+    def get_function(self, var: 'Id', argn: int) -> Optional[int]:
+        return self.function_ids.get((var.id, argn))
+
+    def max_stack(self, start: int, end: int) -> int:
+        """
+        an upper bound on how deep the stack gets while running the code in [start, end), which
+        has to include the lambdas defined in it. Outside of lambdas, code only jumps forward,
+        and tail calls start over with an empty stack. OP_CALL_LOCAL jumps back to a lambda, but
+        a lambda can't be running twice at once, since lambdas can't be recursive, and whatever
+        a lambda pushes is popped again before it returns. So no instruction has its result on
+        the stack twice at the same time, and the JIT relies on this for its stack check.
+        """
+
+        return sum(1 for pc in range(start, end, 2) if self.code[pc] in PUSH_OPS)
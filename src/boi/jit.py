@@ -0,0 +1,233 @@
+from typing import Any, List
+
+from boi.compiler import *
+
+# numba (and numpy) are optional; without them every call is run by the VM
+try:
+    import numpy as np
+    from numba import njit, types
+    from numba.typed import Dict
+
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+# Calls to functions with at most this many arguments are remembered
+MAX_KEY_ARGS = 4
+MEMO_SIZE = 1 << 20
+
+STACK_SIZE = 1 << 16
+MAX_DEPTH = 1 << 14
+
+# Columns of the function table
+START       = 0
+N_ARGS      = 1
+N_LOCALS    = 2
+MEMOIZE     = 3
+MAX_STACK   = 4
+
+
+@njit(cache=True)
+def _memo_key(stack, base, fn, n_args):
+    a0 = stack[base] if n_args > 0 else 0.0
+    a1 = stack[base + 1] if n_args > 1 else 0.0
+    a2 = stack[base + 2] if n_args > 2 else 0.0
+    a3 = stack[base + 3] if n_args > 3 else 0.0
+
+    # -0.0 == 0.0, so the signs of the arguments are packed in with the function
+    signs = 0
+    for i in range(n_args):
+        if np.signbit(stack[base + i]):
+            signs |= 1 << i
+
+    return (float(fn * (1 << MAX_KEY_ARGS) + signs), a0, a1, a2, a3)
+
+
+@njit(cache=True)
+def _run(code, consts, table, memo, stack, frames, fn, argv):
+    if table[fn, N_LOCALS] + table[fn, MAX_STACK] > stack.shape[0]:
+        raise RuntimeError("Interpreter Error: maximum recursion depth exceeded.")
+
+    n_args = len(argv)
+    for i in range(n_args):
+        stack[i] = argv[i]
+
+    if table[fn, MEMOIZE]:
+        key = _memo_key(stack, 0, fn, n_args)
+        if key in memo:
+            return memo[key]
+
+    # frames holds the (return pc, base pointer, function) of every active call, the function
+    # is -1 for calls to lambdas
+    frames[0, 0] = -1
+    frames[0, 1] = 0
+    frames[0, 2] = fn
+    depth = 1
+
+    bp = 0
+    sp = table[fn, N_LOCALS]
+    pc = table[fn, START]
+
+    while True:
+        op = code[pc]
+        arg = code[pc + 1]
+        pc += 2
+
+        if op == OP_LOAD_VAR:
+            stack[sp] = stack[bp + arg]
+            sp += 1
+        elif op == OP_CONST:
+            stack[sp] = consts[arg]
+            sp += 1
+        elif op == OP_ADD:
+            sp -= 1
+            stack[sp - 1] += stack[sp]
+        elif op == OP_SUB:
+            sp -= 1
+            stack[sp - 1] -= stack[sp]
+        elif op == OP_CMP:
+            sp -= 1
+            lhs = stack[sp - 1]
+            rhs = stack[sp]
+
+            if arg == 0:
+                result = lhs > rhs
+            elif arg == 1:
+                result = lhs >= rhs
+            elif arg == 2:
+                result = lhs < rhs
+            elif arg == 3:
+                result = lhs <= rhs
+            elif arg == 4:
+                result = lhs == rhs
+            else:
+                result = lhs != rhs
+
+            stack[sp - 1] = 1.0 if result else 0.0
+        elif op == OP_JMP_IF_FALSE:
+            sp -= 1
+            if stack[sp] == 0.0:
+                pc = arg
+        elif op == OP_JMP:
+            pc = arg
+        elif op == OP_CALL:
+            n_args = table[arg, N_ARGS]
+
+            if table[arg, MEMOIZE]:
+                key = _memo_key(stack, sp - n_args, arg, n_args)
+                if key in memo:
+                    sp -= n_args
+                    stack[sp] = memo[key]
+                    sp += 1
+                    continue
+
+            # The frame of the callee starts at its arguments, and has to fit its locals and
+            # everything it pushes on top of them
+            if depth == frames.shape[0] or sp - n_args + table[arg, N_LOCALS] + table[arg, MAX_STACK] > stack.shape[0]:
+                raise RuntimeError("Interpreter Error: maximum recursion depth exceeded.")
+
+            frames[depth, 0] = pc
+            frames[depth, 1] = bp
+            frames[depth, 2] = arg
+            depth += 1
+
+            bp = sp - n_args
+            sp = bp + table[arg, N_LOCALS]
+            pc = table[arg, START]
+        elif op == OP_RET:
+            result = stack[sp - 1]
+
+            depth -= 1
+            callee = frames[depth, 2]
+
+            if table[callee, MEMOIZE]:
+                if len(memo) >= MEMO_SIZE:
+                    memo.clear()
+                memo[_memo_key(stack, bp, callee, table[callee, N_ARGS])] = result
+
+            if depth == 0:
+                return result
+
+            stack[bp] = result
+            sp = bp + 1
+
+            pc = frames[depth, 0]
+            bp = frames[depth, 1]
+        elif op == OP_CALL_LOCAL:
+            if depth == frames.shape[0]:
+                raise RuntimeError("Interpreter Error: maximum recursion depth exceeded.")
+
+            # Lambdas share the frame of the function they are defined in
+            frames[depth, 0] = pc
+            frames[depth, 1] = bp
+            frames[depth, 2] = -1
+            depth += 1
+
+            pc = arg
+        elif op == OP_RET_LOCAL:
+            depth -= 1
+            pc = frames[depth, 0]
+        elif op == OP_TAILCALL:
+            # Reuse the frame of the current call. The result is remembered for the arguments
+            # of the last call in the chain, which give the same result as the first.
+            n_args = table[arg, N_ARGS]
+            for i in range(n_args):
+                stack[bp + i] = stack[sp - n_args + i]
+
+            sp = bp + table[arg, N_LOCALS]
+            pc = table[arg, START]
+        elif op == OP_STORE_VAR:
+            sp -= 1
+            stack[bp + arg] = stack[sp]
+        elif op == OP_MUL:
+            sp -= 1
+            stack[sp - 1] *= stack[sp]
+        elif op == OP_DIV:
+            sp -= 1
+            stack[sp - 1] /= stack[sp]
+        elif op == OP_POW:
+            sp -= 1
+            lhs = stack[sp - 1]
+            rhs = stack[sp]
+            result = lhs ** rhs
+
+            # Python raises on overflow and on 0 to a negative power, and gives a complex
+            # number for a negative base; leave those to the VM
+            if not np.isfinite(result) and np.isfinite(lhs) and np.isfinite(rhs):
+                raise RuntimeError("Interpreter Error: pow is out of range.")
+
+            stack[sp - 1] = result
+        elif op == OP_POP:
+            sp -= 1
+        else:
+            raise RuntimeError("Interpreter Error: invalid opcode.")
+
+
+class JIT:
+
+    """
+    runs calls to pure functions with a numba compiled copy of the VM loop, over the same code
+    the Compiler produced. Pure functions only ever call other pure functions, so a call
+    never has to leave the compiled loop (intrinsics like print can't be reached from it).
+    """
+
+    def __init__(self, code: List[int], consts: List[float], functions: List[Any]):
+        assert AVAILABLE
+
+        self.code = np.asarray(code, dtype=np.int64)
+        self.consts = np.asarray(consts, dtype=np.float64)
+
+        self.table = np.zeros((len(functions), 5), dtype=np.int64)
+        for i, fn in enumerate(functions):
+            if type(fn) == CodeObject and fn.memo is not None:
+                self.table[i] = (fn.start, fn.n_args, fn.n_locals, fn.n_args <= MAX_KEY_ARGS, fn.max_stack)
+
+        self.memo = Dict.empty(key_type=types.UniTuple(types.float64, MAX_KEY_ARGS + 1), value_type=types.float64)
+        self.stack = np.empty(STACK_SIZE, dtype=np.float64)
+        self.frames = np.empty((MAX_DEPTH, 3), dtype=np.int64)
+
+    def call(self, fn: int, argv: List[float]) -> float:
+        return _run(self.code, self.consts, self.table, self.memo, self.stack, self.frames, fn, np.asarray(argv, dtype=np.float64))
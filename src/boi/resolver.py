@@ -0,0 +1,62 @@
+from typing import Any, Dict, Optional, Tuple
+
+
+class Resolver:
+
+    """
+    assigns every variable a slot in the frame of the function it is bound in, so that
+    looking a variable up at runtime is a list index rather than a walk over dictionaries.
+    Lambdas share the frame of the function they are defined in, so their arguments and
+    locals get slots of their own in that frame. Every AST node knows how to resolve itself;
+    the resolver only keeps track of what is in scope.
+    """
+
+    def __init__(self):
+        self.vars: Dict[str, int] = {}
+        self.lambdas: Dict[Tuple[str, int], Any] = {}
+
+        # The number of slots allocated in the frame of the function being resolved, and the
+        # (name, argn) of every top level function it calls
+        self.n_locals = 0
+        self.calls = set()
+
+        # Lambdas whose bodies are currently being resolved, used to reject recursive lambdas
+        self.resolving = set()
+
+        # Gives the name of every function that is called a small integer id, so that functions
+        # can be kept in lists at runtime. Ids are only handed out for one program, so the names
+        # a long running process has seen don't pile up.
+        self.names: Dict[str, int] = {}
+
+    def enter_function(self):
+        self.vars = {}
+        self.lambdas = {}
+        self.n_locals = 0
+        self.calls = set()
+
+    def push_var(self, var: 'Id') -> int:
+        assert var.id not in self.vars
+
+        var.slot = self.n_locals
+        self.n_locals += 1
+        self.vars[var.id] = var.slot
+
+        return var.slot
+
+    def pop_var(self, var: 'Id'):
+        del self.vars[var.id]
+
+    def get_var(self, var: 'Id') -> Optional[int]:
+        return self.vars.get(var.id)
+
+    def intern(self, var: 'Id') -> int:
+        return self.names.setdefault(var.id, len(self.names))
+
+    def push_lambda(self, fn: 'Function'):
+        self.lambdas[(fn.name.id, len(fn.args))] = fn
+
+    def pop_lambda(self, fn: 'Function'):
+        del self.lambdas[(fn.name.id, len(fn.args))]
+
+    def get_lambda(self, var: 'Id', argn: int) -> Optional['Function']:
+        return self.lambdas.get((var.id, argn))
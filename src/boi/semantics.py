@@ -18,7 +18,7 @@ class BoiSemantics(object):
     def float(self, ast):
         assert type(ast) == str
         value = float(ast)
-        return Value(value, Span.EMPTY)
+        return Value.of(value, Span.EMPTY)
 
     def value(self, ast):
         assert type(ast) == Value
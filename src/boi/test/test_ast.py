@@ -1,3 +1,5 @@
+from io import StringIO
+
 from boi.test.utils import success
 from boi.ast import *
 
@@ -8,20 +10,35 @@ def test_if_expr():
     assert test_true_expr.eval(Context()).value == 1.0
     assert test_false_expr.eval(Context()).value == 0.0
 
+    # let x = 0 in if x then 1 else (if x < 1 then 2 else 3)
+    if_ast = LetExpr(Id("x", Span.EMPTY), Value(0.0, Span.EMPTY),
+                IfExpr(ConditionExpr(Id("x", Span.EMPTY), Span.EMPTY), Value(1.0, Span.EMPTY),
+                    IfExpr(ConditionExpr(ComparisonExpr(Id("x", Span.EMPTY), ComparisonExpr.LT, Value(1.0, Span.EMPTY), Span.EMPTY), Span.EMPTY),
+                        Value(2.0, Span.EMPTY), Value(3.0, Span.EMPTY), Span.EMPTY),
+                    Span.EMPTY),
+                Span.EMPTY)
+    resolver = Resolver()
+    if_ast.resolve(resolver)
+    assert if_ast.eval(Context(resolver.n_locals)).value == 2.0
+
     success("if_expr")
 
 def test_let_expr():
     let_expr = LetExpr(Id("a", Span.EMPTY), Value(5.0, Span.EMPTY), Id("a", Span.EMPTY), Span.EMPTY)
+    resolver = Resolver()
+    let_expr.resolve(resolver)
 
-    assert let_expr.eval(Context()).value == 5.0
+    assert let_expr.eval(Context(resolver.n_locals)).value == 5.0
 
     success("let_expr")
 
 def test_simple_lambda_expr():
     lambda_expr = LambdaExpr(Id("lambda", Span.EMPTY), [Id("a", Span.EMPTY), Id("b", Span.EMPTY)], AdditiveExpr(Id("a", Span.EMPTY), AdditiveExpr.ADDITION, Id("b", Span.EMPTY), Span.EMPTY),
                                 FunctionCall(Id("lambda", Span.EMPTY), [Value(4.0, Span.EMPTY), Value(1.0, Span.EMPTY)], Span.EMPTY), Span.EMPTY)
+    resolver = Resolver()
+    lambda_expr.resolve(resolver)
 
-    assert lambda_expr.eval(Context()).value == 5.0
+    assert lambda_expr.eval(Context(resolver.n_locals)).value == 5.0
 
     success("simple_lambda_expr")
 
@@ -37,14 +54,146 @@ def test_simple_function_call():
 
     success("simple_function_call")
 
+def test_function_purity():
+    # let sum a b = a + b
+    sum_ast = Function(Id("sum", Span.EMPTY), [Id("a", Span.EMPTY), Id("b", Span.EMPTY)], AdditiveExpr(Id("a", Span.EMPTY), AdditiveExpr.ADDITION, Id("b", Span.EMPTY), Span.EMPTY), Span.EMPTY)
+    # let show x = print x
+    show_ast = Function(Id("show", Span.EMPTY), [Id("x", Span.EMPTY)], FunctionCall(Id("print", Span.EMPTY), [Id("x", Span.EMPTY)], Span.EMPTY), Span.EMPTY)
+    # let show_sum a b = show (sum a b)
+    show_sum_ast = Function(Id("show_sum", Span.EMPTY), [Id("a", Span.EMPTY), Id("b", Span.EMPTY)],
+                    FunctionCall(Id("show", Span.EMPTY), [FunctionCall(Id("sum", Span.EMPTY), [Id("a", Span.EMPTY), Id("b", Span.EMPTY)], Span.EMPTY)], Span.EMPTY), Span.EMPTY)
+
+    _program = Program([sum_ast, show_ast, show_sum_ast])
+
+    assert sum_ast.pure
+    assert not show_ast.pure
+    assert not show_sum_ast.pure
+
+    success("function_purity")
+
+def test_duplicate_function():
+    # let one = 1, defined twice
+    one_ast = lambda: Function(Id("one", Span.EMPTY), [], Value(1.0, Span.EMPTY), Span.EMPTY)
+
+    try:
+        Program([one_ast(), one_ast()])
+        assert False
+    except InterpreterException:
+        pass
+
+    # print can not be redefined either
+    try:
+        Program([Function(Id("print", Span.EMPTY), [Id("x", Span.EMPTY)], Id("x", Span.EMPTY), Span.EMPTY)])
+        assert False
+    except InterpreterException:
+        pass
+
+    success("duplicate_function")
+
+def test_function_names():
+    # Every program numbers the names of its functions from scratch
+    for i in range(100):
+        Program([Function(Id(f"f{i}", Span.EMPTY), [], Value(1.0, Span.EMPTY), Span.EMPTY)])
+
+    # let one = 1, print one
+    one_ast = Function(Id("one", Span.EMPTY), [], Value(1.0, Span.EMPTY), Span.EMPTY)
+    program = Program([one_ast, FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("one", Span.EMPTY), [], Span.EMPTY)], Span.EMPTY)])
+    program.run(stdout=StringIO())
+
+    assert len(program.context.functions) == 2
+    assert program.context.get_function(Id("one", Span.EMPTY), 0) is one_ast
+
+    success("function_names")
+
+def test_value_interning():
+    assert Value.of(1.0, Span.EMPTY) is Value.of(1.0, Span.EMPTY)
+    assert Value.of(-128.0, Span.EMPTY) is Value.of(-128.0, Span.EMPTY)
+    assert Value.of(0.5, Span.EMPTY) is not Value.of(0.5, Span.EMPTY)
+    assert str(Value.of(-0.0, Span.EMPTY)) == "-0.0"
+
+    span = Span(0, 3, "1.0")
+    assert Value.of(1.0, span).span is span
+
+    # Equal values are interchangeable as keys
+    memo = {Value(2.5, Span.EMPTY): "a"}
+    assert memo[Value(2.5, Span.EMPTY)] == "a"
+    assert hash(Value.of(1.0, Span.EMPTY)) == hash(Value(1.0, Span.EMPTY))
+
+    success("value_interning")
+
 def test_additive_expr():
     context = Context()
     ast = AdditiveExpr(Value(4.0, Span.EMPTY), AdditiveExpr.ADDITION, Value(4.0, Span.EMPTY), Span.EMPTY)
 
     assert ast.eval(context).value == 8.0
 
+    # let x = 2 in x + 1, which is not folded; the result is the shared 3.0
+    span = Span(0, 5, "x + 1")
+    let_ast = LetExpr(Id("x", Span.EMPTY), Value(2.0, Span.EMPTY),
+                AdditiveExpr(Id("x", Span.EMPTY), AdditiveExpr.ADDITION, Value(1.0, Span.EMPTY), span), Span.EMPTY)
+    resolver = Resolver()
+    let_ast.resolve(resolver)
+    assert let_ast.eval(Context(resolver.n_locals)) is Value.of(3.0, Span.EMPTY)
+
     success("additive_expr")
 
+def test_constant_folding():
+    # (1 + 2) + 3
+    ast = AdditiveExpr(AdditiveExpr(Value(1.0, Span.EMPTY), AdditiveExpr.ADDITION, Value(2.0, Span.EMPTY), Span.EMPTY),
+                        AdditiveExpr.ADDITION, Value(3.0, Span.EMPTY), Span.EMPTY)
+
+    assert type(ast.fold()) == Value
+    assert ast.fold().value == 6.0
+    assert ast.eval(Context()).value == 6.0
+
+    # 1 / 0 has to fail when it is evaluated, not when it is built
+    div_ast = MultiplicativeExpr(Value(1.0, Span.EMPTY), MultiplicativeExpr.DIVISION, Value(0.0, Span.EMPTY), Span.EMPTY)
+    assert div_ast.fold() is div_ast
+
+    if_ast = IfExpr(ComparisonExpr(ast, ComparisonExpr.GT, Value(5.0, Span.EMPTY), Span.EMPTY), Id("a", Span.EMPTY), Id("b", Span.EMPTY), Span.EMPTY)
+    assert if_ast.fold().id == "a"
+
+    success("constant_folding")
+
+def test_pow_expr():
+    # 2 ^ 10
+    ast = PowExpr(Value(2.0, Span.EMPTY), Value(10.0, Span.EMPTY), Span.EMPTY)
+    assert ast.eval(Context()).value == 1024.0
+
+    # let x = 1.5 in x ^ 3
+    x = Id("x", Span.EMPTY)
+    cube_ast = LetExpr(x, Value(1.5, Span.EMPTY), PowExpr(Id("x", Span.EMPTY), Value(3.0, Span.EMPTY), Span.EMPTY), Span.EMPTY)
+    resolver = Resolver()
+    cube_ast.resolve(resolver)
+    assert cube_ast.eval(Context(resolver.n_locals)).value == 3.375
+
+    # let x = 1e200 in x ^ 2 overflows like x ^ 2.5 does, but inf ^ 2 is inf
+    for x_value, exponent in [(1e200, 2.0), (1e200, 2.5), (-1e200, 3.0)]:
+        overflow_ast = LetExpr(Id("x", Span.EMPTY), Value(x_value, Span.EMPTY), PowExpr(Id("x", Span.EMPTY), Value(exponent, Span.EMPTY), Span.EMPTY), Span.EMPTY)
+        resolver = Resolver()
+        overflow_ast.resolve(resolver)
+
+        try:
+            overflow_ast.eval(Context(resolver.n_locals))
+            assert False
+        except OverflowError:
+            pass
+
+    assert PowExpr(Value(math.inf, Span.EMPTY), Value(2.0, Span.EMPTY), Span.EMPTY).eval(Context()).value == math.inf
+
+    # (-8) ^ 0.5 is not folded, and fails when it is evaluated
+    complex_ast = PowExpr(Value(-8.0, Span.EMPTY), Value(0.5, Span.EMPTY), Span.EMPTY)
+    assert complex_ast.fold() is complex_ast
+
+    for evaluate in [complex_ast.eval, complex_ast.eval_num]:
+        try:
+            evaluate(Context())
+            assert False
+        except InterpreterException:
+            pass
+
+    success("pow_expr")
+
 def test_condition_expr():
     context = Context()
     test_false_ast = ConditionExpr(Value(0.0, Span.EMPTY), Span.EMPTY)
@@ -0,0 +1,295 @@
+from io import StringIO
+
+import pytest
+
+from boi.test.utils import success
+from boi.ast import *
+from boi import jit as numba_jit
+
+def fib_program(n: float = 15.0):
+    # let fib x = if x < 2 then 1 else (fib (x - 1)) + (fib (x - 2))
+    fib = Function(Id("fib", Span.EMPTY), [Id("x", Span.EMPTY)],
+                    IfExpr(ComparisonExpr(Id("x", Span.EMPTY), ComparisonExpr.LT, Value(2.0, Span.EMPTY), Span.EMPTY),
+                        Value(1.0, Span.EMPTY),
+                        AdditiveExpr(
+                            FunctionCall(Id("fib", Span.EMPTY), [AdditiveExpr(Id("x", Span.EMPTY), AdditiveExpr.SUBTRACTION, Value(1.0, Span.EMPTY), Span.EMPTY)], Span.EMPTY),
+                            AdditiveExpr.ADDITION,
+                            FunctionCall(Id("fib", Span.EMPTY), [AdditiveExpr(Id("x", Span.EMPTY), AdditiveExpr.SUBTRACTION, Value(2.0, Span.EMPTY), Span.EMPTY)], Span.EMPTY),
+                            Span.EMPTY),
+                        Span.EMPTY),
+                    Span.EMPTY)
+
+    print_fib = FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("fib", Span.EMPTY), [Value(n, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)
+
+    return Program([fib, print_fib])
+
+def count_program(n: float):
+    # let count n acc = if n < 1 then acc else count (n - 1) (acc + 1)
+    count = Function(Id("count", Span.EMPTY), [Id("n", Span.EMPTY), Id("acc", Span.EMPTY)],
+                    IfExpr(ComparisonExpr(Id("n", Span.EMPTY), ComparisonExpr.LT, Value(1.0, Span.EMPTY), Span.EMPTY),
+                        Id("acc", Span.EMPTY),
+                        FunctionCall(Id("count", Span.EMPTY), [
+                            AdditiveExpr(Id("n", Span.EMPTY), AdditiveExpr.SUBTRACTION, Value(1.0, Span.EMPTY), Span.EMPTY),
+                            AdditiveExpr(Id("acc", Span.EMPTY), AdditiveExpr.ADDITION, Value(1.0, Span.EMPTY), Span.EMPTY)
+                        ], Span.EMPTY),
+                        Span.EMPTY),
+                    Span.EMPTY)
+
+    print_count = FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("count", Span.EMPTY), [Value(n, Span.EMPTY), Value(0.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)
+
+    return Program([count, print_count])
+
+def test_vm_fib():
+    sout = StringIO()
+    fib_program().run(stdout=sout)
+
+    assert sout.getvalue() == "987.0\n"
+
+    success("vm_fib")
+
+def test_vm_memo():
+    sout = StringIO()
+    program = fib_program(80.0)
+
+    assert program.statements[0].pure
+
+    # Without remembering results this would take about 2^80 calls
+    program.run(stdout=sout)
+
+    assert sout.getvalue() == "3.78890623731439e+16\n"
+
+    success("vm_memo")
+
+@pytest.mark.skipif(not numba_jit.AVAILABLE, reason="numba is not installed")
+def test_vm_jit():
+    sout = StringIO()
+    program = fib_program(80.0)
+    program.run(stdout=sout, jit=True)
+
+    assert sout.getvalue() == "3.78890623731439e+16\n"
+
+    # The VM drops the JIT if it fails, so make sure it is what ran
+    assert program.vm.jit is not None
+    assert len(program.vm.jit.memo) > 0
+
+    success("vm_jit")
+
+def test_vm_arithmetic():
+    compiler = Compiler()
+    # (10 - 3) * 2 / 4
+    ast = MultiplicativeExpr(
+            MultiplicativeExpr(AdditiveExpr(Value(10.0, Span.EMPTY), AdditiveExpr.SUBTRACTION, Value(3.0, Span.EMPTY), Span.EMPTY),
+                MultiplicativeExpr.MULTIPLICATION, Value(2.0, Span.EMPTY), Span.EMPTY),
+            MultiplicativeExpr.DIVISION, Value(4.0, Span.EMPTY), Span.EMPTY)
+
+    ast.compile(compiler)
+    compiler.emit(OP_RET)
+
+    vm = VM(Context(), compiler.code, compiler.consts, compiler.functions)
+
+    assert vm.run(CodeObject("<test>", 0, 0, 0)) == 3.5
+
+    success("vm_arithmetic")
+
+def test_vm_negative_zero():
+    sout = StringIO()
+
+    # print 0, print -0.0
+    Program([
+        FunctionCall(Id("print", Span.EMPTY), [Value(0.0, Span.EMPTY)], Span.EMPTY),
+        FunctionCall(Id("print", Span.EMPTY), [Value(-0.0, Span.EMPTY)], Span.EMPTY)
+    ]).run(stdout=sout)
+
+    assert sout.getvalue() == "0.0\n-0.0\n"
+
+    # let nz x = x * -1, print (nz 0), print (nz -0.0)
+    nz_program = lambda: Program([
+        Function(Id("nz", Span.EMPTY), [Id("x", Span.EMPTY)], MultiplicativeExpr(Id("x", Span.EMPTY), MultiplicativeExpr.MULTIPLICATION, Value(-1.0, Span.EMPTY), Span.EMPTY), Span.EMPTY),
+        FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("nz", Span.EMPTY), [Value(0.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY),
+        FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("nz", Span.EMPTY), [Value(-0.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)
+    ])
+
+    for jit in [False, True] if numba_jit.AVAILABLE else [False]:
+        sout = StringIO()
+        program = nz_program()
+        program.run(stdout=sout, jit=jit)
+
+        assert sout.getvalue() == "-0.0\n0.0\n"
+
+    # The tree walker shares the memo of the function with the VM
+    nz_call = FunctionCall(Id("nz", Span.EMPTY), [Value(-0.0, Span.EMPTY)], Span.EMPTY)
+    assert program.statements[0].pure
+    assert str(nz_call.eval_num(program.context)) == "0.0"
+
+    success("vm_negative_zero")
+
+def test_vm_lambda():
+    sout = StringIO()
+
+    # let a = 3 in let sq z = z * a in print (sq (sq 2))
+    program = Program([
+        LetExpr(Id("a", Span.EMPTY), Value(3.0, Span.EMPTY),
+            LambdaExpr(Id("sq", Span.EMPTY), [Id("z", Span.EMPTY)],
+                MultiplicativeExpr(Id("z", Span.EMPTY), MultiplicativeExpr.MULTIPLICATION, Id("a", Span.EMPTY), Span.EMPTY),
+                FunctionCall(Id("print", Span.EMPTY), [
+                    FunctionCall(Id("sq", Span.EMPTY), [FunctionCall(Id("sq", Span.EMPTY), [Value(2.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)
+                ], Span.EMPTY),
+                Span.EMPTY),
+            Span.EMPTY)
+    ])
+    program.run(stdout=sout)
+
+    assert sout.getvalue() == "18.0\n"
+
+    success("vm_lambda")
+
+def test_vm_nested_lambdas():
+    sout = StringIO()
+    k = 20
+
+    # let l0 y0 = y0 + 1 in
+    # let l1 y1 = if y1 < 1 then l0 y1 else l0 (y1 - 1) in
+    # ...
+    # print (lk 50)
+    body = FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id(f"l{k}", Span.EMPTY), [Value(50.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)
+
+    for i in range(k, -1, -1):
+        y = lambda: Id(f"y{i}", Span.EMPTY)
+
+        if i == 0:
+            value = AdditiveExpr(y(), AdditiveExpr.ADDITION, Value(1.0, Span.EMPTY), Span.EMPTY)
+        else:
+            prev = Id(f"l{i - 1}", Span.EMPTY)
+            value = IfExpr(ComparisonExpr(y(), ComparisonExpr.LT, Value(1.0, Span.EMPTY), Span.EMPTY),
+                        FunctionCall(prev, [y()], Span.EMPTY),
+                        FunctionCall(prev, [AdditiveExpr(y(), AdditiveExpr.SUBTRACTION, Value(1.0, Span.EMPTY), Span.EMPTY)], Span.EMPTY),
+                        Span.EMPTY)
+
+        body = LambdaExpr(Id(f"l{i}", Span.EMPTY), [y()], value, body, Span.EMPTY)
+
+    program = Program([body])
+
+    # Every lambda is compiled once, no matter how many times it is called
+    compiler = Compiler()
+    program.compile(compiler)
+    assert len(compiler.code) < 40 * (k + 1)
+
+    program.run(stdout=sout)
+    assert sout.getvalue() == "31.0\n"
+
+    success("vm_nested_lambdas")
+
+def test_vm_pow():
+    sout = StringIO()
+
+    # let sq x = x ^ 2, let cube x = x ^ 3, let root x = x ^ 0.5
+    program = Program([
+        Function(Id("sq", Span.EMPTY), [Id("x", Span.EMPTY)], PowExpr(Id("x", Span.EMPTY), Value(2.0, Span.EMPTY), Span.EMPTY), Span.EMPTY),
+        Function(Id("cube", Span.EMPTY), [Id("x", Span.EMPTY)], PowExpr(Id("x", Span.EMPTY), Value(3.0, Span.EMPTY), Span.EMPTY), Span.EMPTY),
+        Function(Id("root", Span.EMPTY), [Id("x", Span.EMPTY)], PowExpr(Id("x", Span.EMPTY), Value(0.5, Span.EMPTY), Span.EMPTY), Span.EMPTY),
+        FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("sq", Span.EMPTY), [Value(-3.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY),
+        FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("cube", Span.EMPTY), [Value(-3.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY),
+        FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("root", Span.EMPTY), [Value(16.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)
+    ])
+    program.run(stdout=sout)
+
+    assert sout.getvalue() == "9.0\n-27.0\n4.0\n"
+
+    # print (sq 1e200) overflows, like it does in the tree walker
+    with pytest.raises(OverflowError):
+        Program([
+            Function(Id("sq", Span.EMPTY), [Id("x", Span.EMPTY)], PowExpr(Id("x", Span.EMPTY), Value(2.0, Span.EMPTY), Span.EMPTY), Span.EMPTY),
+            FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("sq", Span.EMPTY), [Value(1e200, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)
+        ]).run(stdout=StringIO())
+
+    success("vm_pow")
+
+def test_vm_tail_call():
+    sout = StringIO()
+    program = count_program(100000.0)
+
+    assert program.statements[1].argv[0].tail is None
+    assert program.statements[0].value.false_expr.tail is program.statements[0]
+
+    compiler = Compiler()
+    program.compile(compiler)
+    assert OP_TAILCALL in compiler.code[::2]
+
+    # Far deeper than the recursion limit, in the tree walker as well
+    program.run(stdout=sout)
+    assert sout.getvalue() == "100000.0\n"
+
+    assert FunctionCall(Id("count", Span.EMPTY), [Value(100000.0, Span.EMPTY), Value(0.0, Span.EMPTY)], Span.EMPTY).eval_num(program.context) == 100000.0
+
+    success("vm_tail_call")
+
+@pytest.mark.skipif(not numba_jit.AVAILABLE, reason="numba is not installed")
+def test_vm_jit_tail_call():
+    sout = StringIO()
+    program = count_program(100000.0)
+    program.run(stdout=sout, jit=True)
+
+    assert sout.getvalue() == "100000.0\n"
+    assert program.vm.jit is not None
+
+    success("vm_jit_tail_call")
+
+@pytest.mark.skipif(not numba_jit.AVAILABLE, reason="numba is not installed")
+def test_vm_jit_stack_overflow():
+    sout = StringIO()
+
+    # let g x = if x < 1 then 0 else x + (x + ... (g (x - 1))), with 50 additions
+    value = FunctionCall(Id("g", Span.EMPTY), [AdditiveExpr(Id("x", Span.EMPTY), AdditiveExpr.SUBTRACTION, Value(1.0, Span.EMPTY), Span.EMPTY)], Span.EMPTY)
+    for _ in range(50):
+        value = AdditiveExpr(Id("x", Span.EMPTY), AdditiveExpr.ADDITION, value, Span.EMPTY)
+
+    g = Function(Id("g", Span.EMPTY), [Id("x", Span.EMPTY)],
+            IfExpr(ComparisonExpr(Id("x", Span.EMPTY), ComparisonExpr.LT, Value(1.0, Span.EMPTY), Span.EMPTY), Value(0.0, Span.EMPTY), value, Span.EMPTY),
+            Span.EMPTY)
+
+    program = Program([g, FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("g", Span.EMPTY), [Value(2000.0, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)])
+
+    # The temporaries of every call don't fit in the stack of the JIT, so the VM takes over
+    program.run(stdout=sout, jit=True)
+
+    assert sout.getvalue() == "100050000.0\n"
+    assert program.vm.jit is None
+
+    success("vm_jit_stack_overflow")
+
+def test_vm_jit_pow():
+    # let pw x y = x ^ y
+    def pw_program(x: float, y: float):
+        pw = Function(Id("pw", Span.EMPTY), [Id("x", Span.EMPTY), Id("y", Span.EMPTY)], PowExpr(Id("x", Span.EMPTY), Id("y", Span.EMPTY), Span.EMPTY), Span.EMPTY)
+
+        return Program([pw, FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("pw", Span.EMPTY), [Value(x, Span.EMPTY), Value(y, Span.EMPTY)], Span.EMPTY)], Span.EMPTY)])
+
+    # The JIT has to give the same results as the VM, whether it is installed or not
+    for jit in [False, True]:
+        with pytest.raises(ZeroDivisionError):
+            pw_program(0.0, -1.0).run(stdout=StringIO(), jit=jit)
+
+        with pytest.raises(OverflowError):
+            pw_program(1e200, 2.5).run(stdout=StringIO(), jit=jit)
+
+        # There are no complex numbers
+        with pytest.raises(InterpreterException):
+            pw_program(-8.0, 0.5).run(stdout=StringIO(), jit=jit)
+
+        sout = StringIO()
+        program = pw_program(2.0, 0.5)
+        program.run(stdout=sout, jit=jit)
+        assert sout.getvalue() == f"{2.0 ** 0.5}\n"
+        assert (program.vm.jit is not None) == (jit and numba_jit.AVAILABLE)
+
+    # let g x = x + 1, let c = (-8) ^ 0.5 in print (g c)
+    for jit in [False, True]:
+        with pytest.raises(InterpreterException):
+            Program([
+                Function(Id("g", Span.EMPTY), [Id("x", Span.EMPTY)], AdditiveExpr(Id("x", Span.EMPTY), AdditiveExpr.ADDITION, Value(1.0, Span.EMPTY), Span.EMPTY), Span.EMPTY),
+                LetExpr(Id("c", Span.EMPTY), PowExpr(Value(-8.0, Span.EMPTY), Value(0.5, Span.EMPTY), Span.EMPTY),
+                    FunctionCall(Id("print", Span.EMPTY), [FunctionCall(Id("g", Span.EMPTY), [Id("c", Span.EMPTY)], Span.EMPTY)], Span.EMPTY),
+                    Span.EMPTY)
+            ]).run(stdout=StringIO(), jit=jit)
+
+    success("vm_jit_pow")
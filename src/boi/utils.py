@@ -1,3 +1,6 @@
+import math
+from collections import OrderedDict
+
 def list_to_str(a):
     try:
         _ = iter(a)
@@ -10,4 +13,39 @@ def list_to_str(a):
         s += str(item)
     
     # skip the first character, since it will be an extra space
-    return s[1:]
\ No newline at end of file
+    return s[1:]
+
+def memo_key(argv: tuple) -> tuple:
+    """
+    the key the result of a call is remembered under. -0.0 == 0.0, so calls with an argument
+    that is zero also get the signs of their arguments in the key
+    """
+
+    if 0.0 in argv:
+        return argv + tuple([math.copysign(1.0, v) for v in argv])
+
+    return argv
+
+class LRUCache(OrderedDict):
+
+    """
+    a dictionary which forgets its least recently used entry once it holds more than `capacity` entries
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__()
+
+        self.capacity = capacity
+
+    def lookup(self, key, default=None):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+
+        return default
+
+    def store(self, key, value):
+        self[key] = value
+
+        if len(self) > self.capacity:
+            self.popitem(last=False)
@@ -0,0 +1,162 @@
+from typing import Any, List
+
+from boi.compiler import *
+from boi.utils import memo_key
+
+
+class VM:
+
+    """
+    runs the code produced by the Compiler. Values on the stack are plain floats (or bools
+    produced by comparisons). The locals of a call live on the same stack, starting at the
+    base pointer of the call: the arguments are already in place when the call is made, and
+    the rest of the slots are reserved right above them.
+    """
+
+    def __init__(self, context: 'Context', code: List[int], consts: List[float], functions: List[Any], jit: bool = False):
+        self.context = context
+        self.code = code
+        self.consts = consts
+        self.functions = functions
+
+        # Calls to pure functions are handed to the numba compiled loop, if it is installed.
+        # Importing numba is slow, so it is only imported when it is asked for.
+        self.jit = None
+        if jit:
+            from boi import jit as numba_jit
+
+            if numba_jit.AVAILABLE:
+                self.jit = numba_jit.JIT(code, consts, functions)
+
+    def run(self, entry: CodeObject) -> float:
+        code = self.code
+        consts = self.consts
+        functions = self.functions
+        context = self.context
+        jit = self.jit
+
+        stack = [None] * entry.n_locals
+        push = stack.append
+        pop = stack.pop
+
+        # (return pc, base pointer, memo, memo key) of every active caller
+        frames = []
+        bp = 0
+        pc = entry.start
+
+        while True:
+            op = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+
+            if op == OP_LOAD_VAR:
+                push(stack[bp + arg])
+            elif op == OP_CONST:
+                push(consts[arg])
+            elif op == OP_ADD:
+                rhs = pop()
+                stack[-1] += rhs
+            elif op == OP_SUB:
+                rhs = pop()
+                stack[-1] -= rhs
+            elif op == OP_CMP:
+                rhs = pop()
+                stack[-1] = CMP_FNS[arg](stack[-1], rhs)
+            elif op == OP_JMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == OP_JMP:
+                pc = arg
+            elif op == OP_CALL:
+                fn = functions[arg]
+                memo = fn.memo
+                key = None
+
+                if memo is not None and jit is not None:
+                    try:
+                        result = jit.call(arg, stack[len(stack) - fn.n_args:])
+                    except (RuntimeError, TypeError):
+                        # The compiled loop gave up: it ran out of stack or frames, got a pow
+                        # result Python handles differently, or was passed an argument that is
+                        # not a float. Keep going without it.
+                        jit = self.jit = None
+                    else:
+                        del stack[len(stack) - fn.n_args:]
+                        push(result)
+                        continue
+
+                if memo is not None:
+                    key = memo_key(tuple(stack[len(stack) - fn.n_args:]))
+                    result = memo.lookup(key)
+
+                    if result is not None:
+                        del stack[len(stack) - fn.n_args:]
+                        push(result)
+                        continue
+
+                frames.append((pc, bp, memo, key))
+                bp = len(stack) - fn.n_args
+
+                if fn.n_locals > fn.n_args:
+                    stack.extend([None] * (fn.n_locals - fn.n_args))
+
+                pc = fn.start
+            elif op == OP_RET:
+                if not frames:
+                    return pop()
+
+                # Replace the frame of the call with its result
+                stack[bp] = stack[-1]
+                del stack[bp + 1:]
+
+                pc, bp, memo, key = frames.pop()
+
+                if memo is not None:
+                    memo.store(key, stack[-1])
+            elif op == OP_CALL_LOCAL:
+                # Lambdas share the frame of the function they are defined in
+                frames.append((pc, bp, None, None))
+                pc = arg
+            elif op == OP_RET_LOCAL:
+                pc = frames.pop()[0]
+            elif op == OP_TAILCALL:
+                # Move the arguments over those of the current call and start over in the same
+                # frame; the memo key of the call is still the one it was made with
+                fn = functions[arg]
+                stack[bp:bp + fn.n_args] = stack[len(stack) - fn.n_args:]
+                del stack[bp + fn.n_locals:]
+
+                pc = fn.start
+            elif op == OP_STORE_VAR:
+                stack[bp + arg] = pop()
+            elif op == OP_MUL:
+                rhs = pop()
+                stack[-1] *= rhs
+            elif op == OP_DIV:
+                rhs = pop()
+                stack[-1] /= rhs
+            elif op == OP_POW:
+                rhs = pop()
+                result = stack[-1] ** rhs
+
+                if type(result) == complex:
+                    # boi.ast imports this module, so it can only be imported once running
+                    from boi.ast import InterpreterException, PowExpr
+                    raise InterpreterException(PowExpr.COMPLEX_RESULT)
+
+                stack[-1] = result
+            elif op == OP_CALL_INTRINSIC:
+                fn = functions[arg]
+                n_args = len(fn.args)
+
+                if n_args:
+                    argv = stack[-n_args:]
+                    del stack[-n_args:]
+                else:
+                    argv = []
+
+                push(fn.call(context, argv))
+            elif op == OP_POP:
+                pop()
+            else:
+                raise Exception(f"Interpreter Error: invalid opcode {op} at {pc - 2}.")